@@ -3,6 +3,8 @@ import pandas as pd
 from datetime import datetime, timedelta
 import io
 import re
+from copy import copy
+from openpyxl import load_workbook
 from openpyxl.styles import Alignment
 import csv
 
@@ -34,6 +36,11 @@ with st.sidebar:
     selected_sep = sep_map[sep_option]
     selected_conn = conn_map[conn_option]
 
+    # 3. 設定 Excel 匯出方式 (回寫原始檔只更新有變動的儲存格，保留原本版面)
+    export_mode_options = ["重新產生新檔", "回寫原始檔 (僅更新變動儲存格)"]
+    export_mode = st.selectbox("3. Excel 匯出方式", export_mode_options, index=0)
+    is_writeback_mode = export_mode == export_mode_options[1]
+
     if st.button("🔄 清除所有快取與狀態"):
         st.session_state.clear()
         st.rerun()
@@ -175,6 +182,72 @@ def generate_excel_bytes(df, separator):
                 cell.alignment = Alignment(wrap_text=(separator=="\n"), vertical='center')
     return output.getvalue()
 
+def build_sheet_layout(original_bytes, df_raw):
+    """找出 df 每一列在原始工作表中的實際列號；標題或任何一列對不上就回傳 None"""
+    wb = load_workbook(io.BytesIO(original_bytes), read_only=True, data_only=True)
+    ws = wb.worksheets[0]
+    n_cols = len(df_raw.columns)
+    sheet_rows = []
+    for r_no, vals in enumerate(ws.iter_rows(values_only=True), start=1):
+        vals = [None if v is None else str(v) for v in vals[:n_cols]]
+        sheet_rows.append((r_no, vals + [None] * (n_cols - len(vals))))
+    wb.close()
+
+    headers = [str(c) for c in df_raw.columns]
+    df_rows = [[None if pd.isna(v) else str(v) for v in row] for row in df_raw.itertuples(index=False)]
+    non_blank = [r for r in sheet_rows if any(v not in (None, "") for v in r[1])]
+
+    # pandas 依版本不同，可能保留或略過全空白列，兩種對應方式都逐格驗證
+    for candidates in (sheet_rows, non_blank):
+        if len(candidates) < len(df_rows) + 1: continue
+        header_row, header_vals = candidates[0]
+        if not all((h.startswith("Unnamed") if v is None else h == v) for h, v in zip(headers, header_vals)): continue
+        data = candidates[1:len(df_rows) + 1]
+        if all(c[1] == d for c, d in zip(data, df_rows)):
+            return {
+                "header_row": header_row,
+                "orig_headers": headers,
+                "row_map": {idx: c[0] for idx, c in zip(df_raw.index, data)},
+            }
+    return None
+
+def writeback_excel_bytes(original_bytes, layout, df, dirty_cells, date_cols, separator):
+    """開啟原始活頁簿，只回寫有變動的 (列, 日期) 儲存格與改名後的日期標題"""
+    wb = load_workbook(io.BytesIO(original_bytes))
+    ws = wb.worksheets[0]
+
+    def set_wrap(cell):
+        # 只開啟自動換行，保留原本的縮排、旋轉等對齊設定
+        a = copy(cell.alignment)
+        a.wrap_text = True
+        cell.alignment = a
+
+    def write_cell(row_no, col_no, val):
+        cell = ws.cell(row=row_no, column=col_no)
+        cell.value = None if pd.isna(val) or str(val) == "" else str(val)
+        cell.number_format = '@'
+        if separator == "\n": set_wrap(cell)
+
+    # 日期標題與「重新產生新檔」一致，寫成 YYYY-MM-DD
+    for i, (col, orig) in enumerate(zip(df.columns, layout["orig_headers"])):
+        if str(col) != orig: write_cell(layout["header_row"], i + 1, col)
+
+    col_pos = {c: i + 1 for i, c in enumerate(df.columns)}
+    for idx, col in dirty_cells:
+        if col not in col_pos or idx not in layout["row_map"]: continue
+        write_cell(layout["row_map"][idx], col_pos[col], df.at[idx, col])
+
+    # 與「重新產生新檔」一致：未變動但含換行的日期格也要開啟自動換行
+    if separator == "\n":
+        for col in date_cols:
+            if col not in col_pos: continue
+            for idx in df.index[df[col].astype(str).str.contains("\n", regex=False)]:
+                if idx in layout["row_map"] and (idx, col) not in dirty_cells:
+                    set_wrap(ws.cell(row=layout["row_map"][idx], column=col_pos[col]))
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
 # ==========================================
 # 分頁 1: 排班修改工具
 # ==========================================
@@ -183,6 +256,10 @@ with tab1:
     
     if 'working_df' not in st.session_state: st.session_state.working_df = None
     if 'last_uploaded_filename' not in st.session_state: st.session_state.last_uploaded_filename = ""
+    if 'original_xlsx_bytes' not in st.session_state: st.session_state.original_xlsx_bytes = None
+    if 'dirty_cells' not in st.session_state: st.session_state.dirty_cells = set()
+    if 'sheet_layout' not in st.session_state: st.session_state.sheet_layout = None
+    if 'writeback_cache' not in st.session_state: st.session_state.writeback_cache = None
 
     # ==========================================
     # 🚀 步驟 1：上傳原始排班表
@@ -202,10 +279,21 @@ with tab1:
                 else:
                     df_raw = pd.read_excel(uploaded_file, dtype=str)
 
+                # 保留原始 xlsx 與逐列對應表，供「回寫原始檔」模式使用 (.xls / CSV 無法回寫)
+                st.session_state.original_xlsx_bytes = uploaded_file.getvalue() if uploaded_file.name.lower().endswith('.xlsx') else None
+                st.session_state.sheet_layout = None
+                st.session_state.writeback_cache = None
+                if st.session_state.original_xlsx_bytes is not None:
+                    try: st.session_state.sheet_layout = build_sheet_layout(st.session_state.original_xlsx_bytes, df_raw)
+                    except: st.session_state.sheet_layout = None
+                dirty_cells = set()
+
                 # 第一道防線：上傳時立刻執行「終極淨化」
                 for col in df_raw.columns:
                     if re.search(r'\d{1,2}/\d{1,2}', str(col)) or re.match(r'\d{4}-\d{2}-\d{2}', str(col)):
+                        before = df_raw[col].fillna("")
                         df_raw[col] = df_raw[col].apply(ultimate_clean)
+                        dirty_cells.update((idx, col) for idx in df_raw.index[df_raw[col] != before])
 
                 rename_dict = {}
                 for col in df_raw.columns:
@@ -216,6 +304,7 @@ with tab1:
                 
                 if rename_dict: df_raw = df_raw.rename(columns=rename_dict)
                 st.session_state.working_df = df_raw
+                st.session_state.dirty_cells = {(idx, rename_dict.get(col, col)) for idx, col in dirty_cells}
                 st.session_state.last_uploaded_filename = uploaded_file.name
                 st.success("✅ 步驟 1 完成！排班表讀取成功，已自動淨化所有無意義的符號與假時間。")
 
@@ -247,7 +336,9 @@ with tab1:
                             # 🚀 智慧編號補零：如果是純數字才補四碼，P067 這種英文開頭的就原封不動
                             return v_str.zfill(4) if v_str.isdigit() else v_str
                             
+                        before = df[id_col].fillna("")
                         df[id_col] = df[id_col].apply(fix_id)
+                        st.session_state.dirty_cells.update((idx, id_col) for idx in df.index[df[id_col] != before])
                         st.session_state.working_df = df
 
                     if name_col:
@@ -394,7 +485,9 @@ with tab1:
                                     rows = edited[edited["✅執行"]==True]
                                     for _, r in rows.iterrows():
                                         idxs = st.session_state.working_df.index[st.session_state.working_df[name_col] == r['姓名']]
-                                        if len(idxs)>0: st.session_state.working_df.at[idxs[0], r['日期']] = r['修正後內容']
+                                        if len(idxs)>0:
+                                            st.session_state.working_df.at[idxs[0], r['日期']] = r['修正後內容']
+                                            st.session_state.dirty_cells.add((idxs[0], r['日期']))
                                     st.success("✅ 步驟 2 完成！延診時間已寫入。請繼續執行下方的「填補空白格」。")
                                     st.session_state['preview_df'] = None
                                     st.rerun()
@@ -451,6 +544,7 @@ with tab1:
                                     df_temp.at[idx, col] = sta_code if next_is_sta else res_code
                                     next_is_sta = not next_is_sta # 填完切換下一個代號
                                     fill_count += 1
+                                    st.session_state.dirty_cells.add((idx, col))
                                     
                         st.session_state.working_df = df_temp
                         st.session_state.fill_success = f"✅ 步驟 3 完成！成功為正職員工排入了 {fill_count} 個例假日/休息日。您可以下載匯入檔了！"
@@ -462,10 +556,27 @@ with tab1:
             if st.session_state.working_df is not None:
                 df_export = st.session_state.working_df.copy()
                 
+                export_dirty_cells = set(st.session_state.dirty_cells)
                 for col in date_cols_in_df:
                     df_export[col] = df_export[col].apply(lambda x: final_export_clean(x, selected_sep))
+                    before = st.session_state.working_df[col].fillna("").astype(str)
+                    export_dirty_cells.update((idx, col) for idx in df_export.index[df_export[col] != before])
                 
-                data_export = generate_excel_bytes(df_export, selected_sep)
+                if is_writeback_mode and st.session_state.sheet_layout is not None:
+                    # 只有變動內容或分隔符號改變時才重新回寫，避免每次重新整理都完整讀寫活頁簿
+                    cache_key = (selected_sep, tuple(sorted(((str(idx), str(col), str(df_export.at[idx, col])) for idx, col in export_dirty_cells if col in df_export.columns))))
+                    cache = st.session_state.writeback_cache
+                    if cache is None or cache[0] != cache_key:
+                        cache = (cache_key, writeback_excel_bytes(st.session_state.original_xlsx_bytes, st.session_state.sheet_layout, df_export, export_dirty_cells, date_cols_in_df, selected_sep))
+                        st.session_state.writeback_cache = cache
+                    data_export = cache[1]
+                    st.caption(f"📝 回寫模式：僅更新原始檔中 {len(export_dirty_cells)} 個有變動的儲存格，日期標題改為 YYYY-MM-DD。其餘工作表與儲存格格式保留，但圖片、圖表等物件無法保留。")
+                else:
+                    if is_writeback_mode and st.session_state.original_xlsx_bytes is None:
+                        st.warning("⚠️ 原始檔不是 .xlsx，無法回寫，改為重新產生新檔。")
+                    elif is_writeback_mode:
+                        st.warning("⚠️ 原始工作表的列與讀入資料無法逐列對應，為避免寫錯位置，改為重新產生新檔。")
+                    data_export = generate_excel_bytes(df_export, selected_sep)
                 
                 c1, c2, c3 = st.columns(3)
                 with c1: